@@ -1,14 +1,20 @@
 # agent.py
 
 import os
+import re
 import json
+import asyncio
 import logging
+import operator
+import threading
 from google import genai
 from google.genai.types import GenerateContentResponse
 from langgraph.graph import StateGraph, END
-from typing import TypedDict, List
-from langgraph.graph.message import add_messages
-from playwright.sync_api import Page
+from langgraph.types import Send
+from langchain_core.runnables import RunnableConfig
+from typing import TypedDict, List, Dict, Literal, Optional, Annotated
+from playwright.async_api import Page
+from pydantic import BaseModel
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -18,105 +24,330 @@ import tools
 # Configure the client
 client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
 
+def merge_scores(existing, new):
+    """Appends candidate scores; an empty update clears them for a new scan."""
+    if not new:
+        return []
+    return existing + new
+
 class AgentState(TypedDict):
     """Defines the state for our LangGraph agent."""
     page: Page
     objective: str
     page_summary: str
-    interactive_elements: List[dict]
-    past_steps: List[dict]
+    interactive_elements: Dict[str, list]  # One list per field, indexed by element
+    past_steps: Annotated[List[dict], operator.add]  # Nodes return only new steps
     final_data: dict
     plan: List[dict]
     decision: dict
+    page_changed: bool  # Whether the last action navigated or mutated the DOM
+    candidate_scores: Annotated[List[dict], merge_scores]  # Relevance of shortlisted elements
 
-class Agent:
-    def __init__(self):
-        self.client = client
-        self.graph = self._build_graph()
+class DecisionArgs(BaseModel):
+    """Arguments for a planner decision; which fields are set depends on the tool."""
+    agent_id: Optional[str] = None
+    description: Optional[str] = None
+    text: Optional[str] = None
+    selectors: Optional[List[str]] = None
 
-    def _build_graph(self):
-        workflow = StateGraph(AgentState)
-        workflow.add_node("scanner_interactive", self._scanner_interactive_node)
-        workflow.add_node("scanner_full", self._scanner_full_node)
-        workflow.add_node("planner", self._planner_node)
-        workflow.add_node("executor", self._executor_node)
-        workflow.set_entry_point("scanner_interactive")
+class Decision(BaseModel):
+    """Response schema the planner's Gemini call must conform to."""
+    tool: Literal["click", "type", "extract", "finish"]
+    args: DecisionArgs
+    confidence: float
 
-        workflow.add_edge("scanner_interactive", "planner")
-        workflow.add_edge("scanner_full", "planner")
-        workflow.add_edge("executor", "scanner_full") # After action, do a full scan
+class CandidateScore(BaseModel):
+    """Response schema for rating a single element against the objective."""
+    score: float
 
-        workflow.add_conditional_edges(
-            "planner", self._should_continue, {"continue": "executor", "end": END}
-        )
-        return workflow.compile()
+# Attributes worth showing the planner; everything else is layout noise
+PROMPT_ATTRIBUTES = ("id", "name", "type", "placeholder", "aria-label", "href", "value")
+ELEMENTS_HEADER = "agent_id\ttag\ttext\tcontext\tattributes"
+
+def _compact(text, limit=80):
+    """Collapses whitespace so a value fits in a single TSV cell."""
+    return " ".join((text or "").split())[:limit]
+
+def format_elements(elements, indices=None):
+    """
+    Encodes elements as a terse TSV table, which costs far fewer tokens than indented JSON.
+    Only the elements at `indices` are included when given, in that order.
+    """
+    if indices is None:
+        indices = range(len(elements["agent_ids"]))
+    rows = [ELEMENTS_HEADER]
+    for i in indices:
+        attributes = {
+            k: _compact(v) for k, v in elements["attributes"][i].items()
+            if k in PROMPT_ATTRIBUTES and v
+        }
+        rows.append("\t".join((
+            elements["agent_ids"][i],
+            elements["tags"][i],
+            _compact(elements["text"][i]),
+            _compact(elements["context"][i]),
+            json.dumps(attributes, separators=(",", ":")) if attributes else "",
+        )))
+    return "\n".join(rows)
+
+# Pages with more elements than this get a shortlist instead of the full table
+CANDIDATE_MIN_ELEMENTS = 30
+CANDIDATE_COUNT = 5
+# The shortlist replaces the full table only if its best candidate scores this high
+CANDIDATE_MIN_SCORE = 0.5
+STOP_WORDS = {"the", "for", "and", "find", "with", "from", "into", "that", "this"}
+
+def _keywords(text):
+    return {w for w in re.findall(r"[a-z0-9]+", (text or "").lower()) if len(w) > 2} - STOP_WORDS
+
+def pick_candidates(objective, elements, k=CANDIDATE_COUNT):
+    """Cheap pre-filter: indices of the k elements sharing the most keywords with the objective."""
+    goal = _keywords(objective)
+    scored = []
+    for i, (text, context, attributes) in enumerate(
+        zip(elements["text"], elements["context"], elements["attributes"])
+    ):
+        haystack = " ".join((
+            text or "",
+            context or "",
+            *(str(v) for a, v in attributes.items() if a in PROMPT_ATTRIBUTES),
+        ))
+        overlap = len(goal & _keywords(haystack))
+        if overlap:
+            scored.append((overlap, i))
+    scored.sort(key=lambda pair: pair[0], reverse=True)
+    return [i for _, i in scored[:k]]
+
+# Steps shown verbatim in the planner prompt; older ones are summarized
+RECENT_STEPS = 5
+
+def summarize_steps(steps):
+    """One-line digest of steps, e.g. 'type agent-id-4, click agent-id-9 (failure)'."""
+    parts = []
+    for step in steps:
+        if step.get("action", "").startswith("scan_"):
+            continue  # Scans are implied between actions
+        target = (step.get("args") or {}).get("agent_id", "")
+        part = f"{step.get('action')} {target}".strip()
+        if step.get("status") != "success":
+            part += f" ({step.get('status')})"
+        parts.append(part)
+    return ", ".join(parts) or "page scans only"
+
+PLAN_PATH = "plan.json"
 
-    def _scanner_interactive_node(self, state: AgentState):
+def save_plan(plan, path=PLAN_PATH):
+    """Writes the plan atomically, so concurrent runs never leave a half-written file."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(plan, f, indent=2)
+    os.replace(tmp_path, path)
+
+# Number of distinct DOM states whose scan results are kept per agent
+SCAN_CACHE_SIZE = 16
+# Fast-model decisions below this confidence are re-planned with the strong model
+CONFIDENCE_THRESHOLD = 0.7
+
+class Agent:
+    def __init__(self):
+        self.client = client
+        self.fast_model = "gemini-2.0-flash-lite"
+        self.strong_model = "gemini-2.0-flash"
+        self.graph = _GRAPH
+        # DOM fingerprint -> {"elements", "page_summary"}; lets scanners skip
+        # re-scanning a page the previous action did not change.
+        self._scan_cache: Dict[str, dict] = {}
+        # (elements list, its encoding) for the prompt most recently built
+        self._elements_json: tuple = (None, "")
+        # Set by a framenavigated listener while a run is in progress
+        self._navigated = False
+
+    async def _scanner_interactive_node(self, state: AgentState):
         """Node that quickly scans only for interactive elements."""
         logging.info("Scanning for interactive elements...")
-        elements = tools.get_interactive_elements_with_context(state["page"])
-        logging.info(f"Found {len(elements)} interactive elements.")
-        return {
+        page = state["page"]
+        cached = self._scan_cache.get(await tools.get_dom_fingerprint(page))
+        if cached:
+            elements = cached["elements"]
+            logging.info(f"DOM unchanged, reusing {len(elements['agent_ids'])} scanned elements.")
+        else:
+            elements = await tools.get_interactive_elements_with_context(page)
+            await self._remember_scan(page, elements=elements)
+            logging.info(f"Found {len(elements['agent_ids'])} interactive elements.")
+        # page_summary is left as is: this scan only runs on the initial page
+        # or after an action that left the page untouched.
+        update = {
             "interactive_elements": elements,
-            "page_summary": "", # Ensure summary is cleared
-            "past_steps": state["past_steps"]
-            + [{"action": "scan_interactive", "status": "success"}],
+            "past_steps": [{"action": "scan_interactive", "status": "success"}],
         }
+        return self._with_scores_for(state, elements, update)
 
-    def _scanner_full_node(self, state: AgentState):
+    async def _scanner_full_node(self, state: AgentState):
         """Node that does a full scan of page content and interactive elements."""
         logging.info("Performing full page scan...")
-        page_summary = tools.get_page_content_summary(state["page"])
-        elements = tools.get_interactive_elements_with_context(state["page"])
-        logging.info(f"Full scan found {len(elements)} elements and page content.")
-        return {
+        page = state["page"]
+        cached = self._scan_cache.get(await tools.get_dom_fingerprint(page))
+        if cached and cached.get("page_summary") is not None:
+            page_summary, elements = cached["page_summary"], cached["elements"]
+            logging.info("DOM unchanged, reusing previous full scan.")
+        else:
+            # Summary after the scan, so the check in _remember_scan that
+            # nothing changed since the scan covers the summary too
+            elements = await tools.get_interactive_elements_with_context(page)
+            page_summary = await tools.get_page_content_summary(page)
+            await self._remember_scan(page, elements=elements, page_summary=page_summary)
+            logging.info(f"Full scan found {len(elements['agent_ids'])} elements and page content.")
+        update = {
             "page_summary": page_summary,
             "interactive_elements": elements,
-            "past_steps": state["past_steps"]
-            + [{"action": "scan_full", "status": "success"}],
+            "past_steps": [{"action": "scan_full", "status": "success"}],
         }
+        return self._with_scores_for(state, elements, update)
+
+    @staticmethod
+    def _with_scores_for(state: AgentState, elements, update: dict):
+        """
+        Clears candidate scores unless the scan reused the very elements they
+        were given for, in which case they are kept and scoring is skipped.
+        """
+        if elements is not state.get("interactive_elements"):
+            update["candidate_scores"] = []
+        return update
+
+    async def _remember_scan(self, page, elements, page_summary=None):
+        """Caches scan results under the fingerprint of the freshly annotated DOM."""
+        fingerprint = await tools.get_dom_fingerprint(page, since_scan=True)
+        if fingerprint is None:
+            return  # The page moved on since the scan; its results match no DOM
+        previous = self._scan_cache.pop(fingerprint, None)
+        if page_summary is None and previous:
+            page_summary = previous["page_summary"]
+        self._scan_cache[fingerprint] = {"elements": elements, "page_summary": page_summary}
+        while len(self._scan_cache) > SCAN_CACHE_SIZE:
+            self._scan_cache.pop(next(iter(self._scan_cache)))
+
+    def _serialize_elements(self, elements):
+        """Prompt encoding of elements, reused while the scan result itself is reused."""
+        if self._elements_json[0] is not elements:
+            self._elements_json = (elements, format_elements(elements))
+        return self._elements_json[1]
+
+    async def _decide(self, model: str, prompt: str) -> Decision:
+        """Asks the given model for the next action, validated against the decision schema."""
+        response: GenerateContentResponse = await self.client.aio.models.generate_content(
+            model=model,
+            contents=prompt,
+            config={
+                "response_mime_type": "application/json",
+                "response_schema": Decision,
+            },
+        )
+        if response.parsed is None:
+            raise ValueError(f"Response did not match the decision schema: {response.text}")
+        return response.parsed
+
+    @staticmethod
+    def _candidate_filter(state: AgentState):
+        """Fans out one scoring branch per shortlisted element, or goes straight to planning."""
+        elements = state["interactive_elements"]
+        if len(elements["agent_ids"]) <= CANDIDATE_MIN_ELEMENTS:
+            return "planner"
+        if state.get("candidate_scores"):
+            return "planner"  # Already scored these same elements
+        candidates = pick_candidates(state["objective"], elements)
+        if not candidates:
+            return "planner"
+        return [
+            Send("score_candidate", {"objective": state["objective"], "elements": elements, "index": i})
+            for i in candidates
+        ]
+
+    async def _score_candidate_node(self, payload: dict):
+        """Rates how useful one element is for the objective, using the fast model."""
+        elements, index = payload["elements"], payload["index"]
+        agent_id = elements["agent_ids"][index]
+        prompt = (
+            f"Objective: \"{payload['objective']}\".\n"
+            "How likely is interacting with this web page element to be the next step "
+            "towards the objective? Answer with a score from 0 to 1.\n"
+            f"{format_elements(elements, [index])}"
+        )
+        try:
+            response = await self.client.aio.models.generate_content(
+                model=self.fast_model,
+                contents=prompt,
+                config={
+                    "response_mime_type": "application/json",
+                    "response_schema": CandidateScore,
+                },
+            )
+            score = response.parsed.score if response.parsed else 0.0
+        except Exception as e:
+            logging.warning(f"Scoring {agent_id} failed: {e}")
+            score = 0.0
+        return {"candidate_scores": [{"agent_id": agent_id, "score": score}]}
 
-    def _planner_node(self, state: AgentState):
+    def _elements_for_prompt(self, state: AgentState):
+        """Ranked shortlist when a candidate scored well, otherwise every element."""
+        scores = sorted(state.get("candidate_scores") or [], key=lambda c: c["score"], reverse=True)
+        if not scores or scores[0]["score"] < CANDIDATE_MIN_SCORE:
+            return "all interactive elements", self._serialize_elements(state["interactive_elements"])
+        elements = state["interactive_elements"]
+        position = {agent_id: i for i, agent_id in enumerate(elements["agent_ids"])}
+        shortlist = [position[c["agent_id"]] for c in scores if c["agent_id"] in position]
+        return "the most relevant interactive elements, best first", format_elements(elements, shortlist)
+
+    async def _planner_node(self, state: AgentState):
         """The 'brain' node. Decides the next action using Gemini."""
         logging.info("Planning next action...")
 
-        # Build a dynamic prompt
+        # Build a dynamic prompt; only the latest steps are shown in full so the
+        # prompt stays the same size however long the run gets
+        older = state['past_steps'][:-RECENT_STEPS]
+        recent = state['past_steps'][-RECENT_STEPS:]
         prompt_parts = [
-            f"You are a web automation agent. Your high-level objective is: \"{state['objective']}\".",
-            f"You have already taken these steps: {json.dumps(state['past_steps'], indent=2)}"
+            f"You are a web automation agent. Your high-level objective is: \"{state['objective']}\"."
         ]
+        if older:
+            prompt_parts.append(f"Earlier steps, oldest first: {summarize_steps(older)}")
+        prompt_parts.append(f"Your most recent steps: {json.dumps(recent, separators=(',', ':'))}")
 
         if state.get('page_summary'):
             prompt_parts.append(f"\nHere is a summary of the text content on the current page:\n---\n{state['page_summary']}\n---")
 
-        prompt_parts.append(f"\nHere is a JSON list of all interactive elements on the current page:\n---\n{json.dumps(state['interactive_elements'], indent=2)}\n---")
+        described, table = self._elements_for_prompt(state)
+        prompt_parts.append(f"\nHere is a tab-separated table of {described} on the current page:\n---\n{table}\n---")
         prompt_parts.append("\nBased on your objective, the page content, and the available elements, what is the single next action to take?")
         prompt_parts.append(
             """
-Your response must be a valid JSON object with a "tool" and "args".
+Your response must be a JSON object with a "tool" and "args".
 - The "tool" must be one of: "click", "type", "extract", "finish".
 - For "click", 'args' must contain "agent_id" (string) and a "description" (string).
 - For "type", 'args' must contain "agent_id" (string) and "text" (string).
-- For "extract", your 'args' should be a list of concise CSS selectors to get the data. Focus on selectors for elements that contain the final answer to the objective.
+- For "extract", 'args' must contain "selectors", a list of concise CSS selectors to get the data. Focus on selectors for elements that contain the final answer to the objective.
 - Use "finish" when the objective is complete or you are stuck.
+- "confidence" is a number from 0 to 1 saying how sure you are that this is the right next action.
             """
         )
         prompt = "\n".join(prompt_parts)
 
         try:
-            response: GenerateContentResponse = self.client.models.generate_content(
-                model="gemini-2.0-flash",
-                contents=prompt,
-                config={"response_mime_type": "application/json"},
-            )
-            decision = json.loads(response.text)
+            # Try the cheaper, faster model first and escalate only when it is unsure
+            try:
+                parsed = await self._decide(self.fast_model, prompt)
+            except Exception as e:
+                logging.warning(f"{self.fast_model} gave no usable decision, escalating: {e}")
+                parsed = None
+            if parsed is None or parsed.confidence < CONFIDENCE_THRESHOLD:
+                parsed = await self._decide(self.strong_model, prompt)
+            decision = parsed.model_dump(exclude_none=True)
             logging.info(f"Gemini decision: {decision}")
             return {"decision": decision}
-        except (json.JSONDecodeError, Exception) as e:
+        except Exception as e:
             logging.error(f"Error parsing Gemini response or in API call: {e}")
             return {"decision": {"tool": "finish", "args": {"error": str(e)}}}
 
-    def _executor_node(self, state: AgentState):
+    async def _executor_node(self, state: AgentState):
         """The 'hands' node. Executes the decided action."""
         decision = state.get("decision", {})
         tool_name = decision.get("tool")
@@ -128,63 +359,135 @@ Your response must be a valid JSON object with a "tool" and "args".
         )
 
         step_log = {"action": tool_name, "args": args, "status": "pending"}
+        self._navigated = False
 
         try:
             if tool_name == "click":
-                tools.perform_click(page, args["agent_id"])
+                await tools.perform_click(page, args["agent_id"])
                 step_log["status"] = "success"
             elif tool_name == "type":
-                tools.perform_type(page, args["agent_id"], args["text"])
+                await tools.perform_type(page, args["agent_id"], args["text"])
                 step_log["status"] = "success"
+                # Only typing is judged by the dirty flag: a click can change
+                # the page through a request that lands after it returns,
+                # before any mutation shows, so clicks always rescan in full.
+                return {
+                    "past_steps": [step_log],
+                    "page_changed": self._navigated or await tools.has_dom_changed(page),
+                }
             elif tool_name == "extract":
-                data = tools.extract_page_data(page, args)
+                data = await tools.extract_page_data(page, args["selectors"])
                 step_log["status"] = "success"
                 return {
                     "final_data": data,
-                    "past_steps": state["past_steps"] + [step_log],
+                    "past_steps": [step_log],
                 }
 
-            return {"past_steps": state["past_steps"] + [step_log]}
+            return {"past_steps": [step_log], "page_changed": True}
 
         except Exception as e:
             logging.error(f"Tool execution failed for {tool_name}: {e}")
             step_log["status"] = "failure"
             step_log["error"] = str(e)
             return {
-                "past_steps": state["past_steps"] + [step_log],
+                "past_steps": [step_log],
                 "final_data": {
                     "error": f"Execution failed at tool {tool_name}"
                 },
+                "page_changed": True,
             }
 
-    def _should_continue(self, state: AgentState):
+    @staticmethod
+    def _should_continue(state: AgentState):
         """Determines whether to continue the loop or end."""
         if (
             state.get("decision", {}).get("tool") == "finish"
             or state.get("final_data")
         ):
-            plan = [
-                step
-                for step in state["past_steps"]
-                if step.get("status") == "success"
-            ]
-            if plan:  # Only save if there are successful steps
-                with open("plan.json", "w") as f:
-                    json.dump(plan, f, indent=2)
-                logging.info("Plan saved to plan.json")
             return "end"
         return "continue"
 
-    def run(self, page, objective):
+    @staticmethod
+    def _route_after_action(state: AgentState):
+        """Picks the scan that follows an action, or ends once data has been extracted."""
+        if state.get("final_data"):
+            return "end"
+        return "full" if state.get("page_changed", True) else "interactive"
+
+    async def run(self, page, objective):
         initial_state = AgentState(
             page=page,
             objective=objective,
             page_summary="",
-            interactive_elements=[],
+            interactive_elements={},
             past_steps=[],
             final_data={},
             plan=[],
             decision={},
+            page_changed=True,
+            candidate_scores=[],
+        )
+
+        def on_navigated(frame):
+            if frame == page.main_frame:
+                self._navigated = True
+
+        page.on("framenavigated", on_navigated)
+        try:
+            # Increase recursion limit to allow for more complex tasks; an
+            # action takes up to four steps (scan, score, plan, execute)
+            result = await self.graph.ainvoke(
+                initial_state,
+                {"recursion_limit": 70, "configurable": {"agent": self}},
+            )
+        finally:
+            page.remove_listener("framenavigated", on_navigated)
+
+        result["plan"] = [
+            step
+            for step in result["past_steps"]
+            if step.get("status") == "success"
+        ]
+        if result["plan"]:  # Only save if there are successful steps
+            # Written off the event loop once the run is over, not mid-graph
+            await asyncio.to_thread(save_plan, result["plan"])
+            logging.info(f"Plan saved to {PLAN_PATH}")
+        return result
+
+def _agent_node(method_name):
+    """Graph node that delegates to the Agent passed in the run's config."""
+    async def node(state, config: RunnableConfig):
+        agent = config["configurable"]["agent"]
+        return await getattr(agent, method_name)(state)
+    node.__name__ = method_name
+    return node
+
+def _build_graph():
+    workflow = StateGraph(AgentState)
+    workflow.add_node("scanner_interactive", _agent_node("_scanner_interactive_node"))
+    workflow.add_node("scanner_full", _agent_node("_scanner_full_node"))
+    workflow.add_node("score_candidate", _agent_node("_score_candidate_node"))
+    workflow.add_node("planner", _agent_node("_planner_node"))
+    workflow.add_node("executor", _agent_node("_executor_node"))
+    workflow.set_entry_point("scanner_interactive")
+
+    # On large pages, rate a shortlist of elements in parallel before planning
+    for scanner in ("scanner_interactive", "scanner_full"):
+        workflow.add_conditional_edges(
+            scanner, Agent._candidate_filter, ["score_candidate", "planner"]
         )
-        # Increase recursion limit to allow for more complex tasks
-        return self.graph.invoke(initial_state, {"recursion_limit": 50})
\ No newline at end of file
+    workflow.add_edge("score_candidate", "planner")
+
+    workflow.add_conditional_edges(
+        "planner", Agent._should_continue, {"continue": "executor", "end": END}
+    )
+    # After an action, only re-read the whole page if the action changed it
+    workflow.add_conditional_edges(
+        "executor",
+        Agent._route_after_action,
+        {"full": "scanner_full", "interactive": "scanner_interactive", "end": END},
+    )
+    return workflow.compile()
+
+# Compiled once and shared by every Agent; nodes find their Agent in the config
+_GRAPH = _build_graph()
\ No newline at end of file
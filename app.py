@@ -1,7 +1,12 @@
 import os
+import re
 import sys
+import json
+import hashlib
+import shutil
 import subprocess
 import time
+from importlib import metadata
 from pathlib import Path
 
 def check_python_version():
@@ -88,6 +93,19 @@ def setup_env_file(env_path, keys_to_setup, update=False):
         print(f"❌ Error writing .env file: {e}")
         return False
 
+# Leading project name of a requirement line (PEP 508), before any extras,
+# version specifiers or environment markers
+REQUIREMENT_NAME = re.compile(r"[A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?")
+
+def requirement_name(requirement):
+    """Extract the distribution name from a requirements.txt entry"""
+    requirement = requirement.strip()
+    match = REQUIREMENT_NAME.match(requirement)
+    # A scheme such as https: or git+https: starts a URL, not a name
+    if not match or requirement[match.end():match.end() + 1] in (":", "+"):
+        return None
+    return match.group(0)
+
 def check_dependencies():
     """Check if required packages are installed"""
     print("\n--- Checking Dependencies ---")
@@ -95,7 +113,10 @@ def check_dependencies():
     required_packages = []
     try:
         with open("requirements.txt", 'r') as f:
-            required_packages = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+            required_packages = [
+                line.strip() for line in f
+                if line.strip() and not line.startswith(('#', '-'))
+            ]
     except FileNotFoundError:
         print("❌ requirements.txt not found")
         return False
@@ -106,10 +127,16 @@ def check_dependencies():
     
     missing_packages = []
     for package in required_packages:
-        package_name = package.split('==')[0].split('>=')[0].split('<=')[0]
+        package_name = requirement_name(package)
+        if package_name is None:
+            # Paths and URLs name no distribution to look up
+            print(f"⚠️  Skipping check for '{package}': no package name")
+            continue
+        # Look up the installed distribution instead of importing it, which
+        # would run heavy package init code (playwright, langgraph, ...)
         try:
-            __import__(package_name.replace('-', '_'))
-        except ImportError:
+            metadata.version(package_name)
+        except metadata.PackageNotFoundError:
             missing_packages.append(package)
     
     if missing_packages:
@@ -125,13 +152,21 @@ def check_dependencies():
     return True
 
 def install_dependencies():
-    """Install dependencies from requirements.txt"""
+    """Install dependencies from requirements.txt, preferring uv over pip when available"""
     print("\n--- Installing Dependencies ---")
     try:
-        print("Installing packages...")
-        result = subprocess.run([
-            sys.executable, "-m", "pip", "install", "-r", "requirements.txt"
-        ], capture_output=True, text=True, timeout=300)
+        result = None
+        if shutil.which("uv"):
+            print("Installing packages with uv...")
+            result = subprocess.run([
+                "uv", "pip", "install", "--python", sys.executable, "-r", "requirements.txt"
+            ], capture_output=True, text=True, timeout=300)
+        
+        if result is None or result.returncode != 0:
+            print("Installing packages with pip...")
+            result = subprocess.run([
+                sys.executable, "-m", "pip", "install", "-r", "requirements.txt"
+            ], capture_output=True, text=True, timeout=300)
         
         if result.returncode == 0:
             print("✅ Dependencies installed successfully")
@@ -148,12 +183,44 @@ def install_dependencies():
         print(f"❌ Error installing dependencies: {e}")
         return False
 
+API_PROBE_CACHE = Path.home() / ".sidecar" / "api_probe.json"
+API_PROBE_TTL = 24 * 60 * 60  # Seconds a successful probe stays valid
+
+def _key_fingerprint(api_key):
+    """Hash of the API key, so the cache never stores the key itself"""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+def api_probe_is_fresh(api_key):
+    """Check if this API key passed a probe within API_PROBE_TTL"""
+    try:
+        with open(API_PROBE_CACHE, 'r') as f:
+            probe = json.load(f)
+        return (
+            probe.get("key") == _key_fingerprint(api_key)
+            and time.time() - probe.get("last_ok", 0) < API_PROBE_TTL
+        )
+    except (OSError, ValueError):
+        return False
+
+def record_api_probe(api_key, ok):
+    """Remember a successful probe, or forget the last one after a failure"""
+    try:
+        if ok:
+            API_PROBE_CACHE.parent.mkdir(parents=True, exist_ok=True)
+            with open(API_PROBE_CACHE, 'w') as f:
+                json.dump({"key": _key_fingerprint(api_key), "last_ok": time.time()}, f)
+        else:
+            API_PROBE_CACHE.unlink(missing_ok=True)
+    except OSError:
+        pass  # The cache is only an optimization
+
 def test_api_connection():
     """Test if the API key works by making a simple request"""
     print("\n--- Testing API Connection ---")
+    api_key = None
     try:
         from dotenv import load_dotenv
-        import google.generativeai as genai
+        from google import genai
         
         load_dotenv()
         api_key = os.getenv('GOOGLE_API_KEY')
@@ -162,20 +229,27 @@ def test_api_connection():
             print("❌ GOOGLE_API_KEY not found in environment")
             return False
         
-        genai.configure(api_key=api_key)
+        if api_probe_is_fresh(api_key):
+            print("✅ API connection successful (verified within the last 24h)")
+            return True
+        
+        client = genai.Client(api_key=api_key)
         
-        # Test with a simple request
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content("Hello")
+        # Test with a simple request, on the same SDK and model family the agent uses
+        response = client.models.generate_content(model="gemini-2.0-flash-lite", contents="Hello")
         
         if response.text:
+            record_api_probe(api_key, ok=True)
             print("✅ API connection successful")
             return True
         else:
+            record_api_probe(api_key, ok=False)
             print("❌ API connection failed - no response")
             return False
             
     except Exception as e:
+        if api_key:
+            record_api_probe(api_key, ok=False)
         print(f"❌ API connection failed: {e}")
         print("Please check your API key and try again")
         return False
@@ -204,6 +278,15 @@ def run_setup():
     print("=" * 50)
     return True
 
+def print_result(result):
+    """Prints a single tracking result"""
+    if result:
+        # Assuming result is a dictionary like {'voyage_number': '...', 'arrival_date': '...'}
+        for key, value in result.items():
+            print(f"{key.replace('_', ' ').title()}: {value}")
+    else:
+        print("Sorry, we were unable to retrieve the tracking information.")
+
 def main():
     """
     Main application loop to interact with the user and run the tracking agent.
@@ -221,7 +304,7 @@ def main():
         sys.exit(1)
     
     print("\n--- Welcome to the AI-Powered Shipment Tracker ---")
-    print("Enter a Booking ID to track, or type 'quit' to exit.")
+    print("Enter a Booking ID to track (or several, separated by commas), or type 'quit' to exit.")
 
     while True:
         booking_id = input("\nEnter Booking ID: ")
@@ -230,26 +313,26 @@ def main():
             print("Thank you for using the tracker. Goodbye!")
             break
 
-        if not booking_id:
+        booking_ids = [i.strip() for i in booking_id.split(',') if i.strip()]
+        if not booking_ids:
             print("Please enter a valid Booking ID.")
             continue
             
-        print(f"\nInitiating tracking for ID: {booking_id}...")
+        print(f"\nInitiating tracking for ID: {', '.join(booking_ids)}...")
         
         # Call the orchestrator to do the heavy lifting
         # The orchestrator will decide whether to use the Agent or Executor
         start_time = time.time()
         try:
-            result = orchestrator.run_task(booking_id=booking_id, carrier="HMM")
+            if len(booking_ids) == 1:
+                results = {booking_ids[0]: orchestrator.run_task(booking_id=booking_ids[0], carrier="HMM")}
+            else:
+                results = orchestrator.run_batch(booking_ids, carrier="HMM")
             end_time = time.time()
 
-            print("\n--- Tracking Result ---")
-            if result:
-                # Assuming result is a dictionary like {'voyage_number': '...', 'arrival_date': '...'}
-                for key, value in result.items():
-                    print(f"{key.replace('_', ' ').title()}: {value}")
-            else:
-                print("Sorry, we were unable to retrieve the tracking information.")
+            for tracked_id, result in results.items():
+                print(f"\n--- Tracking Result: {tracked_id} ---")
+                print_result(result)
             
             print(f"-----------------------")
             print(f"(Task completed in {end_time - start_time:.2f} seconds)")
@@ -1,8 +1,9 @@
 # main.py
 
+import asyncio
 import logging
-from playwright.sync_api import sync_playwright
 from agent import Agent
+import tools
 
 # --- Configuration ---
 URL = "http://www.seacargotracking.net/"
@@ -18,29 +19,25 @@ def setup_logging():
         datefmt='%Y-%m-%d %H:%M:%S'
     )
 
-def main():
+async def main():
     """Main function to run the web automation agent."""
     setup_logging()
     
-    with sync_playwright() as p:
-        try:
-            browser = p.chromium.launch(headless=False) # Set headless=True for background execution
-            page = browser.new_page(ignore_https_errors=True)
-            page.set_default_timeout(60000)  # 60 seconds
-            page.goto(URL)
+    try:
+        async with tools.leased_page() as page:
+            await page.goto(URL)
 
             agent = Agent()
-            result = agent.run(page, OBJECTIVE)
+            result = await agent.run(page, OBJECTIVE)
             
             logging.info("Agent run finished. Final State:")
             logging.info(result)
 
-        except Exception as e:
-            logging.error(f"An error occurred during the agent run: {e}")
-        finally:
-            if 'browser' in locals() and browser.is_connected():
-                browser.close()
-            logging.info("Browser closed. Run complete.")
+    except Exception as e:
+        logging.error(f"An error occurred during the agent run: {e}")
+    finally:
+        await tools.close_browser()
+        logging.info("Browser closed. Run complete.")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    asyncio.run(main()) 
\ No newline at end of file
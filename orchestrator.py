@@ -1,13 +1,62 @@
-from google import genai
-from dotenv import load_dotenv
-import os
-load_dotenv()
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-client = genai.Client(api_key=GOOGLE_API_KEY)
+# orchestrator.py
 
-class Orchestrator(): 
-    def __init__():
+import asyncio
+import atexit
+import logging
+from typing import Dict, List, Optional
+from agent import Agent
+from main import URL
+import tools
 
-    def __run_task():
+# --- Configuration ---
+OBJECTIVE_TEMPLATE = "Find the tracking details for the {carrier} ID '{booking_id}'."
+MAX_CONCURRENT_TASKS = 4  # Agents running at once during a batch
+# ---
 
-    
\ No newline at end of file
+# Playwright objects are bound to the loop that created them, so every task
+# runs on this one loop to keep the pooled browser usable between calls.
+_loop = asyncio.new_event_loop()
+
+def _shutdown():
+    """Closes the pooled browser and the loop when the interpreter exits."""
+    _loop.run_until_complete(tools.close_browser())
+    _loop.close()
+
+atexit.register(_shutdown)
+
+async def run_task_async(booking_id: str, carrier: str = "HMM") -> Optional[dict]:
+    """Runs one agent on a pooled page and returns the extracted data."""
+    async with tools.leased_page() as page:
+        await page.goto(URL)
+
+        objective = OBJECTIVE_TEMPLATE.format(carrier=carrier, booking_id=booking_id)
+        result = await Agent().run(page, objective)
+        return result.get("final_data") or None
+
+async def run_batch_async(
+    booking_ids: List[str], carrier: str = "HMM", max_concurrency: int = MAX_CONCURRENT_TASKS
+) -> Dict[str, Optional[dict]]:
+    """
+    Tracks several booking IDs concurrently on the pooled browser.
+    Returns a mapping of booking ID to its result (None when tracking failed).
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def track(booking_id: str) -> Optional[dict]:
+        async with semaphore:
+            try:
+                return await run_task_async(booking_id, carrier)
+            except Exception as e:
+                logging.error(f"Tracking failed for {booking_id}: {e}")
+                return None
+
+    results = await asyncio.gather(*(track(booking_id) for booking_id in booking_ids))
+    return dict(zip(booking_ids, results))
+
+def run_task(booking_id: str, carrier: str = "HMM") -> Optional[dict]:
+    """Synchronous entry point for tracking a single booking ID."""
+    return _loop.run_until_complete(run_task_async(booking_id, carrier))
+
+def run_batch(booking_ids: List[str], carrier: str = "HMM") -> Dict[str, Optional[dict]]:
+    """Synchronous entry point for tracking several booking IDs at once."""
+    return _loop.run_until_complete(run_batch_async(booking_ids, carrier))
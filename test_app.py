@@ -0,0 +1,20 @@
+# test_app.py
+
+import unittest
+
+from app import requirement_name
+
+class RequirementNameTest(unittest.TestCase):
+    def test_named_requirements(self):
+        self.assertEqual(requirement_name("pydantic"), "pydantic")
+        self.assertEqual(requirement_name("google-genai>=1.0"), "google-genai")
+        self.assertEqual(requirement_name("playwright[extra] ; python_version > '3.8'"), "playwright")
+        self.assertEqual(requirement_name("pkg @ https://example.com/pkg.whl"), "pkg")
+
+    def test_paths_and_urls_have_no_name(self):
+        self.assertIsNone(requirement_name("./local_pkg"))
+        self.assertIsNone(requirement_name("https://example.com/pkg-1.0-py3-none-any.whl"))
+        self.assertIsNone(requirement_name("git+https://github.com/org/pkg.git"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,90 +1,422 @@
 # browser_tools.py
 
+import asyncio
+import json
 import logging
-from playwright.sync_api import Page
-from bs4 import BeautifulSoup
+from contextlib import asynccontextmanager
+from playwright.async_api import async_playwright, Browser, CDPSession, Locator, Page, Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
 import re
-from typing import List, Dict, Any
+from typing import AsyncIterator, List, Dict, Any, Optional
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def get_interactive_elements_with_context(page: Page) -> List[Dict[str, Any]]:
+# --- Browser pool ---
+# One shared browser, launched on first use and kept warm between runs, plus a
+# few ready-made pages so a task only waits for a context when the pool is dry.
+HEADLESS = True  # Set False to watch the agent work
+PAGE_TIMEOUT_MS = 60000  # 60 seconds
+LAUNCH_ARGS = ["--disable-dev-shm-usage", "--no-sandbox"]
+WARM_PAGES = 2
+
+_playwright = None
+_browser: Optional[Browser] = None
+_browser_lock: Optional[asyncio.Lock] = None
+_warm_pages: Optional[asyncio.Queue] = None
+_refills: set = set()  # Pending background refills, kept so they aren't collected
+
+async def get_browser() -> Browser:
+    """Returns the shared browser, launching it on first use."""
+    global _playwright, _browser, _browser_lock
+    if _browser_lock is None:
+        _browser_lock = asyncio.Lock()
+    async with _browser_lock:
+        if _browser is None or not _browser.is_connected():
+            if _playwright is None:
+                _playwright = await async_playwright().start()
+            _browser = await _playwright.chromium.launch(headless=HEADLESS, args=LAUNCH_ARGS)
+    return _browser
+
+async def _new_page() -> Page:
+    """Opens a page in a fresh, isolated context on the shared browser."""
+    browser = await get_browser()
+    context = await browser.new_context(ignore_https_errors=True)
+    page = await context.new_page()
+    page.set_default_timeout(PAGE_TIMEOUT_MS)
+    return page
+
+async def get_pooled_page() -> Page:
+    """Takes a warm page from the pool, or opens one if the pool is empty."""
+    global _warm_pages
+    if _warm_pages is None:
+        _warm_pages = asyncio.Queue()
+    while not _warm_pages.empty():
+        page = _warm_pages.get_nowait()
+        if not page.is_closed():
+            return page
+    return await _new_page()
+
+async def _refill_pool():
+    """Opens warm pages until the pool is full again."""
+    try:
+        while (
+            _warm_pages is not None and _warm_pages.qsize() < WARM_PAGES
+            and _browser is not None and _browser.is_connected()
+        ):
+            _warm_pages.put_nowait(await _new_page())
+    except PlaywrightError as e:
+        logging.warning(f"Could not refill the page pool: {e}")
+
+async def release_page(page: Page):
+    """Closes a leased page's context and tops the pool back up in the background."""
+    await page.context.close()
+    # Off the caller's return path; close_browser cancels it if it's still
+    # pending. One refill at a time, or concurrent releases would overfill.
+    if not _refills:
+        task = asyncio.create_task(_refill_pool())
+        _refills.add(task)
+        task.add_done_callback(_refills.discard)
+
+@asynccontextmanager
+async def leased_page():
+    """Checks a page out of the pool for the duration of the block."""
+    page = await get_pooled_page()
+    try:
+        yield page
+    finally:
+        await release_page(page)
+
+async def close_browser():
+    """Shuts down the shared browser, its warm pages and the Playwright driver."""
+    global _playwright, _browser, _warm_pages
+    for task in list(_refills):
+        task.cancel()
+    await asyncio.gather(*_refills, return_exceptions=True)
+    if _browser is not None and _browser.is_connected():
+        await _browser.close()
+    if _playwright is not None:
+        await _playwright.stop()
+    _playwright = _browser = _warm_pages = None
+
+# Elements an agent may act on; compiled once here rather than per call
+_INTERACTIVE_SEL = "a, button, input, textarea, [role='button'], [onclick]"
+
+# Runs inside the page over the elements matched by a locator: annotates each
+# one in place and returns its description, so the whole scan costs a single
+# round-trip and no ElementHandles.
+# Elements are also kept in window.__agentElements so actions can reach them
+# without resolving a selector, and a MutationObserver raises
+# window.__domDirty whenever the DOM changes after the scan. Hidden and
+# disabled elements are skipped since the agent cannot interact with them.
+_SCAN_ELEMENTS_JS = """
+(els, { includeOuterHtml, maxOuterHtml, maxText, limit }) => {
+    // Drop ids from the previous scan so a skipped element cannot keep a stale one
+    Object.values(window.__agentElements || {}).forEach((el) => el.removeAttribute("data-agent-id"));
+    window.__agentElements = {};
+    // getClientRects() is empty for display:none and detached elements, and
+    // unlike offsetParent it also works for position:fixed ones
+    const reachable = (el) => !el.disabled && el.getClientRects().length > 0;
+    // Siblings often share a parent div, so read each parent's text only once
+    const parentText = new Map();
+    const contextOf = (parent) => {
+        if (!parent) return "";
+        if (!parentText.has(parent)) {
+            parentText.set(parent, (parent.innerText || "").trim().slice(0, 200));
+        }
+        return parentText.get(parent);
+    };
+    const columns = { agent_ids: [], tags: [], attributes: [], text: [], context: [] };
+    if (includeOuterHtml) columns.outer_html = [];
+    let i = 0;
+    for (const el of els) {
+        // Very large pages stop here instead of returning their long tail
+        if (limit != null && i >= limit) break;
+        if (!reachable(el)) continue;
+        const agentId = `agent-id-${i++}`;
+        el.setAttribute("data-agent-id", agentId);
+        window.__agentElements[agentId] = el;
+        const parent = el.parentElement && el.parentElement.closest("div");
+        columns.agent_ids.push(agentId);
+        columns.tags.push(el.tagName.toLowerCase());
+        columns.attributes.push(Array.from(el.attributes).reduce((acc, attr) => { acc[attr.name] = attr.value; return acc; }, {}));
+        // Capped in the page, e.g. for a filled textarea
+        if (includeOuterHtml) columns.outer_html.push(el.outerHTML.slice(0, maxOuterHtml));
+        columns.text.push((el.innerText || "").trim().slice(0, maxText));
+        columns.context.push(contextOf(parent));
+    }
+    if (!window.__domObserver) {
+        window.__domObserver = new MutationObserver(() => { window.__domDirty = true; });
+        window.__domObserver.observe(document, { subtree: true, childList: true, attributes: true, characterData: true });
+    }
+    // Our own data-agent-id writes are not a page change
+    window.__domObserver.takeRecords();
+    window.__domDirty = false;
+    // The ids just written changed the markup any cached fingerprint was taken from
+    window.__domFingerprint = null;
+    return columns;
+}
+"""
+
+# How long a scan waits for the first interactive element to appear
+ELEMENT_WAIT_TIMEOUT_MS = 5000
+
+async def get_interactive_elements_with_context(
+    page: Page,
+    selector: str = _INTERACTIVE_SEL,
+    include_outer_html: bool = False,
+    max_outer_html: int = 512,
+    max_text: int = 256,
+    limit: Optional[int] = None,
+) -> Dict[str, list]:
     """
     Finds all interactive elements on the page and annotates them with a unique ID.
-    Returns a list of dictionaries, each representing an element.
+    Returns one list per field (agent_ids, tags, attributes, text, context, and
+    outer_html when `include_outer_html` is set), where index i of every list
+    describes the same element.
+    `selector` picks which elements count as interactive; `max_outer_html`
+    and `max_text` cap the length of those fields for each element, and
+    `limit` caps how many elements are returned.
     """
-    page.wait_for_load_state('networkidle')
+    # Wait for the elements themselves rather than for 'networkidle', which
+    # pages with analytics or long-polling connections may never reach
+    await page.wait_for_load_state('domcontentloaded')
+    try:
+        await page.locator(selector).first.wait_for(state='attached', timeout=ELEMENT_WAIT_TIMEOUT_MS)
+    except PlaywrightError:
+        pass  # No interactive elements yet; scan whatever is there
 
-    interactive_elements = page.query_selector_all(
-        "a, button, input, textarea, [role='button'], [onclick]"
+    # Playwright's selector engine also reaches into open shadow roots,
+    # which document.querySelectorAll would miss
+    columns = await page.locator(selector).evaluate_all(
+        _SCAN_ELEMENTS_JS,
+        {
+            "includeOuterHtml": include_outer_html,
+            "maxOuterHtml": max_outer_html,
+            "maxText": max_text,
+            "limit": limit,
+        },
     )
+    return _intern_columns(columns)
 
-    elements_with_context = []
-    for i, element in enumerate(interactive_elements):
-        agent_id = f"agent-id-{i}"
-        element.evaluate('(element, agentId) => element.setAttribute("data-agent-id", agentId)', agent_id)
+# Row key for each column; the rest keep their column name
+_ROW_KEYS = {"agent_ids": "agent_id", "tags": "tag"}
 
-        # Get context around the element
-        outer_html = element.evaluate("el => el.outerHTML")
+async def iter_interactive_elements_with_context(
+    page: Page, limit: Optional[int] = None, **scan_options
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yields the interactive elements one dict at a time (agent_id, tag,
+    attributes, text, context and outer_html when requested), so callers can
+    filter or stop early without building a row list. The scan itself is
+    still a single call; `limit` stops it after that many elements.
+    """
+    columns = await get_interactive_elements_with_context(page, limit=limit, **scan_options)
+    keys = [_ROW_KEYS.get(name, name) for name in columns]
+    for values in zip(*columns.values()):
+        yield dict(zip(keys, values))
 
-        element_info = {
-            "agent_id": agent_id,
-            "tag": element.evaluate("el => el.tagName.toLowerCase()"),
-            "attributes": element.evaluate("el => Array.from(el.attributes).reduce((acc, attr) => { acc[attr.name] = attr.value; return acc; }, {})"),
-            "outer_html": outer_html,
-            "text": element.evaluate("el => el.innerText")
-        }
-        elements_with_context.append(element_info)
+def _intern_columns(columns: Dict[str, list]) -> Dict[str, list]:
+    """
+    Collapses repeated strings (tags, attribute names and values, shared
+    parent context) into one object each. JSON decoding creates a fresh str
+    for every occurrence, and form-heavy pages repeat the same few a lot.
+    """
+    strings: Dict[str, str] = {}
+    intern = lambda s: strings.setdefault(s, s)
+    columns["tags"] = [intern(tag) for tag in columns["tags"]]
+    columns["attributes"] = [
+        {intern(name): intern(value) for name, value in attrs.items()}
+        for attrs in columns["attributes"]
+    ]
+    columns["text"] = [intern(text) for text in columns["text"]]
+    columns["context"] = [intern(context) for context in columns["context"]]
+    return columns
 
-    return elements_with_context
+async def _evaluate_unless_navigating(page: Page, expression: str, arg: Any = None, default: Any = None) -> Any:
+    """page.evaluate, or `default` when a navigation destroys the context mid-call."""
+    try:
+        return await page.evaluate(expression, arg)
+    except PlaywrightError:
+        return default
 
-def perform_click(page: Page, agent_id: str):
+async def has_dom_changed(page: Page) -> bool:
+    """
+    Reports whether the DOM changed since the last element scan.
+    A new document has no observer installed yet, so navigation counts as a change.
+    """
+    return await _evaluate_unless_navigating(page, "() => window.__domDirty !== false", default=True)
+
+# FNV-1a hash of the serialized DOM, kept on the window until the scan's
+# MutationObserver sees a change or a navigation replaces the window.
+_DOM_FINGERPRINT_JS = """
+(sinceScan) => {
+    if (window.__domDirty === false && window.__domFingerprint) return window.__domFingerprint;
+    if (sinceScan && window.__domDirty !== false) return null;
+    const html = document.documentElement.outerHTML;
+    let hash = 0x811c9dc5;
+    for (let i = 0; i < html.length; i++) {
+        hash ^= html.charCodeAt(i);
+        hash = Math.imul(hash, 0x01000193);
+    }
+    window.__domFingerprint = `${html.length}:${(hash >>> 0).toString(16)}`;
+    return window.__domFingerprint;
+}
+"""
+
+async def get_dom_fingerprint(page: Page, since_scan: bool = False) -> Optional[str]:
+    """
+    Returns a short fingerprint that changes whenever the page's DOM does,
+    or None if the page navigated mid-call and no stable DOM can be named.
+    With `since_scan`, also None once the DOM changed after the last element
+    scan, so the fingerprint is sure to describe what that scan saw.
+    """
+    return await _evaluate_unless_navigating(page, _DOM_FINGERPRINT_JS, since_scan)
+
+# Types into a registered element without resolving a selector. Returns false
+# when the element is gone or is not an editable field that took focus; the
+# caller then types through a locator instead.
+_TYPE_JS = """
+([agentId, text]) => {
+    const el = (window.__agentElements || {})[agentId];
+    if (!el || !el.isConnected) return false;
+    const isField = el.tagName === "TEXTAREA" || (el.tagName === "INPUT"
+        && !/^(checkbox|radio|button|submit|reset|file|image|hidden|range|color)$/.test(el.type));
+    if (!(isField && !el.readOnly) && !el.isContentEditable) return false;
+    el.focus();
+    // Text must not land in whatever else still has focus
+    if (el.getRootNode().activeElement !== el) return false;
+    if (!document.execCommand("insertText", false, text)) {
+        if (!isField) return false;
+        el.value += text;
+        el.dispatchEvent(new InputEvent("input", { bubbles: true, data: text, inputType: "insertText" }));
+    }
+    el.dispatchEvent(new Event("change", { bubbles: true }));
+    return true;
+}
+"""
+
+# agent_ids come back from the model, so only this shape is put into a selector
+_AGENT_ID_RE = re.compile(r"agent-id-\d+")
+
+# How long an action waits for its element before giving up
+ACTION_TIMEOUT_MS = 5000
+
+def _agent_locator(page: Page, agent_id: str) -> Locator:
+    if not _AGENT_ID_RE.fullmatch(agent_id):
+        raise ValueError(f"Invalid agent_id: {agent_id}")
+    # A node the page cloned may carry the same id; act on the first
+    return page.locator(f"[data-agent-id='{agent_id}']").first
+
+async def perform_click(page: Page, agent_id: str):
     """Clicks an element with the given agent_id."""
-    selector = f"[data-agent-id='{agent_id}']"
-    element = page.query_selector(selector)
-    if element:
-        element.click()
-    else:
-        raise ValueError(f"Could not find element with agent_id: {agent_id}")
-
-def perform_type(page: Page, agent_id: str, text: str):
+    # One call: Playwright resolves the selector in the page and waits for
+    # any navigation the click starts
+    try:
+        await _agent_locator(page, agent_id).click(timeout=ACTION_TIMEOUT_MS)
+    except PlaywrightTimeoutError as e:
+        raise ValueError(f"Could not click element with agent_id: {agent_id}") from e
+
+async def _type_with_keyboard(page: Page, agent_id: str, text: str):
+    try:
+        await _agent_locator(page, agent_id).press_sequentially(text, timeout=ACTION_TIMEOUT_MS)
+    except PlaywrightTimeoutError as e:
+        raise ValueError(f"Could not type into element with agent_id: {agent_id}") from e
+
+async def perform_type(page: Page, agent_id: str, text: str):
     """Types text into an element with the given agent_id."""
-    selector = f"[data-agent-id='{agent_id}']"
-    element = page.query_selector(selector)
-    if element:
-        element.type(text)
-    else:
-        raise ValueError(f"Could not find element with agent_id: {agent_id}")
-
-def extract_page_data(page: Page, selectors: List[str]) -> Dict[str, str]:
-    """Extracts data from the page based on a list of CSS selectors."""
-    data = {}
-    for selector in selectors:
-        element = page.query_selector(selector)
-        if element:
-            data[selector] = element.inner_text()
+    if await page.evaluate(_TYPE_JS, [agent_id, text]):
+        return
+    await _type_with_keyboard(page, agent_id, text)
+
+# _TYPE_JS over a list of [agentId, text] pairs, stopping at the first miss so
+# the caller can type that one before the rest; returns how many were typed
+_TYPE_ALL_JS = f"""
+(fills) => {{
+    const type = {_TYPE_JS.strip()};
+    let done = 0;
+    while (done < fills.length && type(fills[done])) done++;
+    return done;
+}}
+"""
+
+async def perform_actions(page: Page, actions: List[Dict[str, str]]):
+    """
+    Runs a sequence of {"op": "click" | "type", "agent_id", "text"} actions in order.
+    Consecutive types are filled in a single call to the page; clicks still
+    go one at a time since any of them may navigate.
+    """
+    fills: List[List[str]] = []
+
+    async def flush_fills():
+        while fills:
+            done = await page.evaluate(_TYPE_ALL_JS, fills)
+            if done < len(fills):
+                await _type_with_keyboard(page, *fills[done])
+            del fills[:done + 1]
+
+    for action in actions:
+        if action["op"] == "type":
+            fills.append([action["agent_id"], action["text"]])
+            continue
+        await flush_fills()
+        if action["op"] == "click":
+            await perform_click(page, action["agent_id"])
         else:
-            data[selector] = "Not found"
-    return data
+            raise ValueError(f"Unknown action: {action['op']}")
+    await flush_fills()
+
+# Reads every selector in one pass inside the page; invalid selectors are
+# reported like missing ones instead of failing the whole extract.
+_EXTRACT_JS = """
+(selectors) => Object.fromEntries(selectors.map((selector) => {
+    let el = null;
+    try { el = document.querySelector(selector); } catch (e) {}
+    return [selector, el ? el.innerText : "Not found"];
+}))
+"""
+
+# Raw CDP sessions for extraction, one per page, opened on first use
+_cdp_sessions: Dict[Page, CDPSession] = {}
+
+async def _cdp_session(page: Page) -> Optional[CDPSession]:
+    """Returns the page's CDP session, or None if the browser doesn't speak CDP."""
+    if page not in _cdp_sessions:
+        # Pages may come from outside the pool, so evict on close rather than on release
+        page.once("close", lambda _: _cdp_sessions.pop(page, None))
+        try:
+            _cdp_sessions[page] = await page.context.new_cdp_session(page)
+        except PlaywrightError:
+            _cdp_sessions[page] = None  # Not Chromium; don't retry every call
+    return _cdp_sessions[page]
+
+async def extract_page_data(page: Page, selectors: List[str]) -> Dict[str, str]:
+    """Extracts data from the page based on a list of CSS selectors."""
+    session = await _cdp_session(page)
+    if session is None:
+        return await page.evaluate(_EXTRACT_JS, selectors)
+
+    # Read-only, so skip Playwright's evaluate machinery and talk CDP directly
+    response = await session.send("Runtime.evaluate", {
+        "expression": f"JSON.stringify(({_EXTRACT_JS})({json.dumps(selectors)}))",
+        "returnByValue": True,
+    })
+    if "exceptionDetails" in response:
+        raise RuntimeError(f"Extraction failed: {response['exceptionDetails'].get('text')}")
+    return json.loads(response["result"]["value"])
+
+# Rendered body text (no script/style contents), with line breaks and runs of
+# 2+ spaces collapsed to one break per phrase and truncated in the page.
+_PAGE_TEXT_JS = """
+(maxLength) => (document.body ? document.body.innerText : "")
+    // Cleanup rarely shrinks text more than 4x, so only a prefix is worth cleaning
+    .slice(0, maxLength * 4)
+    .replace(/[ \\t]*(?:\\n|[ \\t]{2,})\\s*/g, "\\n")
+    .trim()
+    .slice(0, maxLength)
+"""
 
-def get_page_content_summary(page: Page) -> str:
+async def get_page_content_summary(page: Page, max_length: int = 5000) -> str:
     """
     Gets a summary of the page's text content, cleaned for the LLM.
     """
-    soup = BeautifulSoup(page.content(), "html.parser")
-    
-    # Remove script and style elements
-    for script_or_style in soup(["script", "style"]):
-        script_or_style.decompose()
-
-    text = soup.get_text()
-    
-    # Clean up whitespace
-    lines = (line.strip() for line in text.splitlines())
-    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-    cleaned_text = '\n'.join(chunk for chunk in chunks if chunk)
-    
-    # Truncate for brevity
-    max_length = 5000 
-    return cleaned_text[:max_length] if len(cleaned_text) > max_length else cleaned_text
\ No newline at end of file
+    return await page.evaluate(_PAGE_TEXT_JS, max_length)